@@ -1,13 +1,20 @@
 import os
 import json
+import time
 import asyncio
+import logging
 from pathlib import Path
-from typing import Dict, Optional, Any
+from typing import Dict, NamedTuple, Optional, Any, Tuple
 
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # optional: falls back to stdlib json
+    orjson = None
+
 load_dotenv()
 
 def _env_int(name: str) -> int:
@@ -24,36 +31,42 @@ DATA_PATH = Path("data.json")
 
 LIFETIME_SECONDS = 300  # 5 minutes
 
-GROUPS = {
-    "iracing": {
-        "label": "IRACING VOICE CHANNELS",
-        "category_id": _env_int("CATEGORY_IRACING"),
-        "panel_id": _env_int("PANEL_IRACING"),
-        "presets": [
+class Group(NamedTuple):
+    label: str
+    category_id: int
+    panel_id: int
+    presets: Tuple[str, ...]
+
+GROUPS: Dict[str, Group] = {
+    "iracing": Group(
+        label="IRACING VOICE CHANNELS",
+        category_id=_env_int("CATEGORY_IRACING"),
+        panel_id=_env_int("PANEL_IRACING"),
+        presets=(
             "stintONE Motorsport",
             "stintONE Motorsport Black",
             "stintONE Motorsport White",
             "stintONE Motorsport Blue",
             "stintONE Motorsport Gold",
             "stintONE Motorsport Silver",
-        ],
-    },
-    "training": {
-        "label": "IRACING TRAINING AREA",
-        "category_id": _env_int("CATEGORY_TRAINING"),
-        "panel_id": _env_int("PANEL_TRAINING"),
-        "presets": [
+        ),
+    ),
+    "training": Group(
+        label="IRACING TRAINING AREA",
+        category_id=_env_int("CATEGORY_TRAINING"),
+        panel_id=_env_int("PANEL_TRAINING"),
+        presets=(
             "Training",
             "Training I",
             "Training II",
             "Training III",
-        ],
-    },
-    "live": {
-        "label": "LIVE ON STREAM",
-        "category_id": _env_int("CATEGORY_LIVE"),
-        "panel_id": _env_int("PANEL_LIVE"),
-        "presets": [
+        ),
+    ),
+    "live": Group(
+        label="LIVE ON STREAM",
+        category_id=_env_int("CATEGORY_LIVE"),
+        panel_id=_env_int("PANEL_LIVE"),
+        presets=(
             "stintONE Motorsport LIVE",
             "stintONE Black LIVE",
             "stintONE White LIVE",
@@ -61,97 +74,207 @@ GROUPS = {
             "stintONE Gold LIVE",
             "stintONE Silver LIVE",
             "stintONE Rosé LIVE",
-        ],
-    },
+        ),
+    ),
 }
 
 def load_state() -> dict:
     if not DATA_PATH.exists():
-        return {"channels": {}}  # channel_id -> {group_key, created_at, last_empty_at}
+        return {"channels": {}}  # channel_id -> {group_key, deadline}
     try:
         return json.loads(DATA_PATH.read_text("utf-8"))
     except Exception:
         return {"channels": {}}
 
-def save_state(state: dict) -> None:
-    DATA_PATH.write_text(json.dumps(state, indent=2, ensure_ascii=False), encoding="utf-8")
+def dump_state(state: dict) -> bytes:
+    # Serialize to one buffer and write it once; json.dump(fp) would issue a write() per token.
+    if orjson is not None:
+        return orjson.dumps(state, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(state, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def write_state_bytes(data: bytes) -> None:
+    # Write to a temp file and rename over, so a crash mid-write never leaves a truncated data.json.
+    tmp = DATA_PATH.with_suffix(".json.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, DATA_PATH)
+
+def _migrate_tracked(tracked: Dict[int, Dict[str, Any]]) -> None:
+    # Older data.json files stored created_at/last_empty_at instead of the deadline.
+    for info in tracked.values():
+        if "deadline" not in info:
+            created_at = float(info.pop("created_at", 0))
+            last_empty_at = float(info.pop("last_empty_at", created_at))
+            info["deadline"] = max(created_at, last_empty_at) + LIFETIME_SECONDS
 
 state = load_state()
-tracked: Dict[str, Dict[str, Any]] = state.get("channels", {})  # keys are str(channel_id)
-
-# channel_id -> asyncio.Task
-delete_tasks: Dict[int, asyncio.Task] = {}
+# JSON only has string keys; keep native int channel ids in memory and let the serializer stringify them.
+tracked: Dict[int, Dict[str, Any]] = {int(k): v for k, v in state.get("channels", {}).items()}
+_migrate_tracked(tracked)
+state["channels"] = tracked
+panel_messages: Dict[str, int] = state.setdefault("panel_messages", {})  # group_key -> panel message id
+
+log = logging.getLogger(__name__)
+
+# Set whenever state changes; the persister coalesces bursts into a single write.
+# Created by start_persister(): on Python 3.9 an Event binds to whatever loop is current at construction.
+_dirty: Optional[asyncio.Event] = None
+PERSIST_DELAY_SECONDS = 0.5
+PERSIST_RETRY_SECONDS = 5
+_stopping = False  # set by MyBot.close(): write once more without the debounce delay, then exit
+
+def mark_dirty():
+    if _dirty is not None:
+        _dirty.set()
+
+async def _persister():
+    while True:
+        await _dirty.wait()
+        if not _stopping:
+            await asyncio.sleep(PERSIST_DELAY_SECONDS)
+        _dirty.clear()
+        try:
+            # Serialize on the loop thread so the snapshot can't race with handlers mutating state;
+            # only the disk write goes to a worker thread.
+            await asyncio.to_thread(write_state_bytes, dump_state(state))
+        except Exception:
+            log.exception("Failed to write %s; retrying in %ss", DATA_PATH, PERSIST_RETRY_SECONDS)
+            if _stopping:
+                return
+            _dirty.set()
+            await asyncio.sleep(PERSIST_RETRY_SECONDS)
+            continue
+        if _stopping and not _dirty.is_set():
+            return
 
-intents = discord.Intents.default()
+def start_persister() -> asyncio.Task:
+    global _dirty
+    _dirty = asyncio.Event()
+    return asyncio.create_task(_persister())
+
+async def stop_persister(task: asyncio.Task):
+    # Wake the persister for a final, undelayed write and wait for it, so no write is still
+    # in flight on data.json.tmp once this returns.
+    global _stopping
+    _stopping = True
+    _dirty.set()
+    await task
+
+# channel_id -> pending deletion timer
+delete_handles: Dict[int, asyncio.TimerHandle] = {}
+# deletes whose timer already fired; held here so they aren't garbage-collected mid-flight
+deleting: set[asyncio.Task] = set()
+
+# Only channel and voice-state events are used; interactions arrive regardless of intents and
+# panel lookups go through REST, so everything else is left off.
+intents = discord.Intents.none()
 intents.guilds = True
 intents.voice_states = True
 
 def now_mono() -> float:
-    return asyncio.get_running_loop().time()
+    return time.monotonic()
 
 def track_channel(channel_id: int, group_key: str, created_at: float):
-    tracked[str(channel_id)] = {
+    tracked[channel_id] = {
         "group_key": group_key,
-        "created_at": created_at,
-        "last_empty_at": created_at,  # assume empty at creation; will update on join/leave events
+        "deadline": created_at + LIFETIME_SECONDS,  # assume empty at creation; pushed back when it empties again
     }
-    state["channels"] = tracked
-    save_state(state)
+    mark_dirty()
 
 def untrack_channel(channel_id: int):
-    tracked.pop(str(channel_id), None)
-    state["channels"] = tracked
-    save_state(state)
+    tracked.pop(channel_id, None)
+    mark_dirty()
 
 def get_track(channel_id: int) -> Optional[dict]:
-    return tracked.get(str(channel_id))
+    return tracked.get(channel_id)
 
 def cancel_delete(channel_id: int):
-    t = delete_tasks.pop(channel_id, None)
-    if t and not t.done():
-        t.cancel()
+    h = delete_handles.pop(channel_id, None)
+    if h:
+        h.cancel()
+
+SWEEP_SECONDS = 300
+
+def _sweep_delete_handles():
+    # Defensive: drop timers and tracking for channels that vanished without a delete event
+    # reaching us. After a re-IDENTIFY the channel cache is empty until GUILD_CREATE arrives,
+    # so only sweep when every guild is available.
+    if bot.is_ready() and bot.guilds and not any(g.unavailable for g in bot.guilds):
+        for cid in list(delete_handles):
+            if bot.get_channel(cid) is None:
+                cancel_delete(cid)
+                untrack_channel(cid)
+    asyncio.get_running_loop().call_later(SWEEP_SECONDS, _sweep_delete_handles)
+
+async def _do_delete(channel: discord.VoiceChannel):
+    cid = channel.id
+    fresh = channel.guild.get_channel(cid)
+    if not fresh or not isinstance(fresh, discord.VoiceChannel):
+        untrack_channel(cid)
+        return
+
+    # Only delete if still empty at deletion time
+    if len(fresh.members) > 0:
+        return
+
+    try:
+        await fresh.delete(reason="Auto-delete temp voice channel (TTL)")
+    except Exception:
+        return
+
+    names = CATEGORY_NAMES.get(fresh.category_id)
+    category = fresh.category
+    if names is not None and category is not None:
+        # The gateway delete hasn't reached the cache yet, so skip the channel itself; a
+        # manually created duplicate keeps the name taken.
+        if not any(
+            isinstance(c, discord.VoiceChannel) and c.id != cid and c.name == fresh.name
+            for c in category.channels
+        ):
+            names.discard(fresh.name)
+    untrack_channel(cid)
 
 async def schedule_delete(channel: discord.VoiceChannel):
-    info = get_track(channel.id)
+    cid = channel.id
+    info = get_track(cid)
     if not info:
         return
 
     # Cancel any existing timer and create a fresh one.
-    cancel_delete(channel.id)
-
-    created_at = float(info.get("created_at", 0))
-    last_empty_at = float(info.get("last_empty_at", created_at))
+    cancel_delete(cid)
 
-    # Delete at max(created+5min, empty+5min)
-    due = max(created_at + LIFETIME_SECONDS, last_empty_at + LIFETIME_SECONDS)
-    delay = max(0.0, due - now_mono())
-
-    async def _runner():
-        try:
-            await asyncio.sleep(delay)
+    delay = max(0.0, info["deadline"] - now_mono())
 
-            fresh = channel.guild.get_channel(channel.id)
-            if not fresh or not isinstance(fresh, discord.VoiceChannel):
-                untrack_channel(channel.id)
-                return
+    def _fire():
+        delete_handles.pop(cid, None)
+        t = asyncio.create_task(_do_delete(channel))
+        deleting.add(t)
+        t.add_done_callback(deleting.discard)
 
-            # Only delete if still empty at deletion time
-            if len(fresh.members) > 0:
-                return
+    # A bare timer until it fires; only the delete itself needs a task.
+    delete_handles[cid] = asyncio.get_running_loop().call_later(delay, _fire)
 
-            try:
-                await fresh.delete(reason="Auto-delete temp voice channel (TTL)")
-            except Exception:
-                return
+# group_key -> its category, resolved once in on_ready
+RESOLVED: Dict[str, discord.CategoryChannel] = {}
 
-            untrack_channel(channel.id)
-        finally:
-            delete_tasks.pop(channel.id, None)
+# category_id -> names of the voice channels in it; kept current by the channel events below.
+CATEGORY_NAMES: Dict[int, set[str]] = {}
 
-    delete_tasks[channel.id] = asyncio.create_task(_runner())
+def index_category(category: discord.CategoryChannel) -> set[str]:
+    names = {c.name for c in category.channels if isinstance(c, discord.VoiceChannel)}
+    CATEGORY_NAMES[category.id] = names
+    return names
 
 def used_voice_names(category: discord.CategoryChannel) -> set[str]:
-    return {c.name for c in category.channels if isinstance(c, discord.VoiceChannel)}
+    names = CATEGORY_NAMES.get(category.id)
+    if names is None:
+        names = index_category(category)
+    return names
+
+def reindex_parent(channel: discord.abc.GuildChannel):
+    # Only refresh categories we've already indexed; others are indexed lazily on first use.
+    category = channel.category
+    if category is not None and category.id in CATEGORY_NAMES:
+        index_category(category)
 
 # ---- UI ----
 class PresetButtonsView(discord.ui.View):
@@ -160,58 +283,64 @@ class PresetButtonsView(discord.ui.View):
         super().__init__(timeout=None)
         self.group_key = group_key
         g = GROUPS[group_key]
-        presets = g["presets"]
+        presets = g.presets
 
         # Buttons: max 25 per message (we’re below that).
         for preset in presets:
-            custom_id = f"create_vc:{group_key}:{preset}"
-            self.add_item(PresetButton(label=preset, custom_id=custom_id))
+            self.add_item(PresetButton(group_key, preset))
 
 class PresetButton(discord.ui.Button):
-    def __init__(self, label: str, custom_id: str):
-        super().__init__(label=label, style=discord.ButtonStyle.primary, custom_id=custom_id)
+    def __init__(self, group_key: str, preset_name: str):
+        # custom_id format: create_vc:<group_key>:<preset_name>
+        custom_id = f"create_vc:{group_key}:{preset_name}"
+        super().__init__(label=preset_name, style=discord.ButtonStyle.primary, custom_id=custom_id)
+        # Resolved once here so clicks don't have to parse custom_id back apart.
+        self.group_key = group_key
+        self.preset_name = preset_name
 
     async def callback(self, interaction: discord.Interaction):
-        # custom_id format: create_vc:<group_key>:<preset_name>
-        try:
-            _, group_key, preset_name = self.custom_id.split(":", 2)
-        except Exception:
-            await interaction.response.send_message("Bad button config.", ephemeral=True)
-            return
+        group_key = self.group_key
+        preset_name = self.preset_name
 
         guild = interaction.guild
         if guild is None:
             await interaction.response.send_message("Use this in a server.", ephemeral=True)
             return
 
-        g = GROUPS.get(group_key)
-        if not g:
-            await interaction.response.send_message("Unknown group.", ephemeral=True)
-            return
-
-        category = guild.get_channel(g["category_id"])
-        if not isinstance(category, discord.CategoryChannel):
-            await interaction.response.send_message("Category ID is wrong or missing.", ephemeral=True)
-            return
+        g = GROUPS[group_key]
+        category = RESOLVED.get(group_key)
+        if category is None:
+            category = guild.get_channel(g.category_id)
+            if not isinstance(category, discord.CategoryChannel):
+                await interaction.response.send_message("Category ID is wrong or missing.", ephemeral=True)
+                return
 
         # If exists already, do not create another.
-        existing = discord.utils.get(category.channels, name=preset_name)
-        if isinstance(existing, discord.VoiceChannel):
+        used = used_voice_names(category)
+        if preset_name in used:
             await interaction.response.send_message("That channel already exists.", ephemeral=True)
             return
 
+        # Reserve the name before the REST call, so a double-click during it sees it as taken.
+        used.add(preset_name)
+
         # Create channel, inherit category overwrites
         try:
             created = await guild.create_voice_channel(
                 name=preset_name,
                 category=category,
-                overwrites=dict(category.overwrites),
+                overwrites=category.overwrites,  # already a fresh dict
                 reason=f"Create preset voice channel ({group_key})",
             )
         except Exception as e:
+            # Re-read the set: a channel event may have re-indexed the category meanwhile.
+            used_voice_names(category).discard(preset_name)
             await interaction.response.send_message(f"Create failed: {e!r}", ephemeral=True)
             return
 
+        # Re-add in case a channel event re-indexed the category before ours was cached.
+        used_voice_names(category).add(preset_name)
+
         # Track and schedule deletion (5 min after creation unless occupied)
         created_at = now_mono()
         track_channel(created.id, group_key, created_at)
@@ -224,6 +353,8 @@ class PresetButton(discord.ui.Button):
 
 # ---- Bot ----
 class MyBot(commands.Bot):
+    persister: Optional[asyncio.Task] = None
+
     async def setup_hook(self):
         # Register persistent views (one per group)
         self.group_views: Dict[str, PresetButtonsView] = {}
@@ -232,68 +363,159 @@ class MyBot(commands.Bot):
             self.group_views[group_key] = v
             self.add_view(v)
 
-bot = MyBot(command_prefix="!", intents=intents)
+        self.persister = start_persister()
+        self.loop.call_later(SWEEP_SECONDS, _sweep_delete_handles)
+
+    async def close(self):
+        for h in delete_handles.values():
+            h.cancel()
+        delete_handles.clear()
+        # Let deletes already in flight finish while the HTTP session is still open.
+        await asyncio.gather(*deleting, return_exceptions=True)
+
+        try:
+            if self.persister:
+                await stop_persister(self.persister)
+        except Exception:
+            log.exception("Failed to flush %s on close", DATA_PATH)
+        finally:
+            await super().close()
+
+# No message cache: nothing reads cached messages, and it is the bulk of memory on busy guilds.
+bot = MyBot(command_prefix="!", intents=intents, max_messages=None)
 
 async def ensure_panel_message(panel: discord.TextChannel, group_key: str):
     """Ensure the panel has a single bot message with the right buttons."""
+    # Fast path: the message we posted last time, fetched in a single request.
+    mid = panel_messages.get(group_key)
+    if mid:
+        try:
+            msg = await panel.fetch_message(mid)
+            if msg.components:
+                return
+        except discord.NotFound:
+            pass
+
     # Try to find an existing bot message with components.
+    bot_user_id = bot.user.id
     async for msg in panel.history(limit=50):
-        if msg.author == bot.user and msg.components:
+        if msg.author.id == bot_user_id and msg.components:
             # Keep it. (If you want strict matching, we can check custom_ids too.)
+            # Remember it so the next start skips this scan.
+            if panel_messages.get(group_key) != msg.id:
+                panel_messages[group_key] = msg.id
+                mark_dirty()
             return
 
     g = GROUPS[group_key]
-    await panel.send(
-        f"**{g['label']}**\n"
+    sent = await panel.send(
+        f"**{g.label}**\n"
         f"Click a button to create a voice channel.\n"
         f"Channels auto-delete 5 minutes after creation or 5 minutes after they become empty.",
         view=bot.group_views[group_key],
     )
+    panel_messages[group_key] = sent.id
+    mark_dirty()
 
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user} (id={bot.user.id})")
 
-    # Ensure the button message exists in each panel channel
+    # Ensure the button message exists in each panel channel. Each check is a REST round-trip,
+    # so run them concurrently, bounded to stay well inside Discord's rate limits.
+    sem = asyncio.Semaphore(5)
+
+    async def _ensure_one(panel: discord.TextChannel, group_key: str):
+        async with sem:
+            await ensure_panel_message(panel, group_key)
+
+    jobs = []
     for guild in bot.guilds:
         for group_key, g in GROUPS.items():
-            panel = guild.get_channel(g["panel_id"])
+            panel = guild.get_channel(g.panel_id)
             if isinstance(panel, discord.TextChannel):
-                try:
-                    await ensure_panel_message(panel, group_key)
-                except Exception:
-                    pass
+                jobs.append(_ensure_one(panel, group_key))
+    await asyncio.gather(*jobs, return_exceptions=True)
 
-    # Cleanup tracked channels that no longer exist
+    # Resolve each group's category and index its voice channel names
     for guild in bot.guilds:
-        for channel_id_str in list(tracked.keys()):
-            cid = int(channel_id_str)
-            ch = guild.get_channel(cid)
-            if ch is None:
+        for group_key, g in GROUPS.items():
+            category = guild.get_channel(g.category_id)
+            if isinstance(category, discord.CategoryChannel):
+                RESOLVED[group_key] = category
+                index_category(category)
+
+    await cleanup_tracked()
+
+async def cleanup_tracked():
+    """Untrack channels that no longer exist and make sure empty ones have a timer."""
+    # A channel of a guild that is still unavailable is missing from the cache too, so don't
+    # untrack anything until all are back; on_guild_available runs this again then.
+    guilds_available = not any(g.unavailable for g in bot.guilds)
+    for cid in list(tracked):
+        ch = bot.get_channel(cid)
+        if ch is None:
+            if guilds_available:
                 untrack_channel(cid)
-                continue
-            if isinstance(ch, discord.VoiceChannel) and len(ch.members) == 0:
-                # If empty, ensure it has a timer
-                await schedule_delete(ch)
+            continue
+        if isinstance(ch, discord.VoiceChannel) and len(ch.members) == 0:
+            # If empty, ensure it has a timer
+            await schedule_delete(ch)
+
+@bot.event
+async def on_guild_available(guild: discord.Guild):
+    if bot.is_ready():
+        await cleanup_tracked()
 
 @bot.event
 async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    # Mute/deafen/stream toggles don't move anyone between channels.
+    if before.channel is after.channel:
+        return
+
     # If someone joined a tracked temp channel, cancel deletion timer
-    if after.channel and isinstance(after.channel, discord.VoiceChannel):
-        info = get_track(after.channel.id)
-        if info:
-            # channel is occupied: cancel delete
-            cancel_delete(after.channel.id)
+    # (only tracked channels ever have one, so no get_track() needed)
+    ch = after.channel
+    if isinstance(ch, discord.VoiceChannel):
+        cancel_delete(ch.id)
 
     # If someone left a tracked temp channel and it became empty, schedule deletion
-    if before.channel and isinstance(before.channel, discord.VoiceChannel):
-        info = get_track(before.channel.id)
+    ch = before.channel
+    if isinstance(ch, discord.VoiceChannel) and not ch.members:
+        info = get_track(ch.id)
         if info:
-            ch = before.channel
-            if len(ch.members) == 0:
-                # Update last_empty_at and schedule delete
-                info["last_empty_at"] = now_mono()
-                save_state(state)
-                await schedule_delete(ch)
+            # Push the deadline back and schedule delete
+            info["deadline"] = now_mono() + LIFETIME_SECONDS
+            mark_dirty()
+            await schedule_delete(ch)
+
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    reindex_parent(channel)
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    reindex_parent(channel)
+    if isinstance(channel, discord.CategoryChannel):
+        CATEGORY_NAMES.pop(channel.id, None)
+        for group_key, category in list(RESOLVED.items()):
+            if category.id == channel.id:
+                del RESOLVED[group_key]
+    # Covers manual deletes too, so no timer or tracking entry outlives its channel.
+    cancel_delete(channel.id)
+    if get_track(channel.id):
+        untrack_channel(channel.id)
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    reindex_parent(before)
+    if after.category_id != before.category_id:
+        reindex_parent(after)
+
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:  # optional, and not available on Windows
+    pass
 
 bot.run(TOKEN)